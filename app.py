@@ -1,22 +1,35 @@
 import os
 import pandas as pd
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import time
-from urllib.parse import urlparse
-from flask import Flask, render_template, request, redirect, url_for, flash, send_file, jsonify, session
+import re
+import random
+from flask import Flask, render_template, request, redirect, url_for, flash, send_file, session, Response
 from werkzeug.utils import secure_filename
-import json
+import orjson
 import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor, wait
+from collections import namedtuple, deque
 from datetime import datetime
 import uuid
+import csv
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-change-this'
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['OUTPUT_FOLDER'] = 'outputs'
-app.config['HISTORY_FILE'] = 'history.json'
+app.config['HISTORY_FILE'] = 'history.jsonl'  # One JSON entry per line, append-only
+app.config['LEGACY_HISTORY_FILE'] = 'history.json'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
+def json_response(payload):
+    """Like jsonify, but encoded with orjson."""
+    return app.response_class(orjson.dumps(payload), mimetype='application/json')
+
 @app.template_filter('datetimeformat')
 def datetimeformat(value, format='%Y-%m-%d %H:%M:%S'):
     if value:
@@ -32,32 +45,192 @@ os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
 
 # Global variables
-processing_logs = []
+MAX_LOG_ENTRIES = 1000  # Per job
+MAX_LOGGED_JOBS = 20  # Finished jobs whose logs are kept; older ones are dropped
+LOGS = {}  # process_id -> deque of (seq, message) pairs, oldest dropped first
+log_seq = 0  # Sequence number of the latest log entry, never reset
+log_lock = threading.Lock()
+finished_log_jobs = deque()  # Finished or failed jobs that still have logs, oldest first
+log_subscribers = {}  # process_id -> set of queues, one per open /stream connection
+open_streams = 0  # /stream connections currently holding a server thread
+STREAM_KEEPALIVE_SECONDS = 15
+STREAM_MAX_SECONDS = 60  # Streams end after this; EventSource reconnects from the last event id
+MAX_OPEN_STREAMS = 4  # Half of gunicorn's threads, so streams can't starve normal requests
 processing_status = {}  # Store processing status by a unique ID
 saved_api_key = ""  # Global variable to store API key
 
-def add_log(message):
+# Background pool for CSV jobs, so uploads don't each spawn a fresh thread
+MAX_CONCURRENT_JOBS = 4
+MAX_IN_FLIGHT = 8  # Upper bound on batches each job sends to Apollo concurrently
+JOB_EXECUTOR = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_JOBS, thread_name_prefix="csv-job")
+
+APOLLO_URL = "https://api.apollo.io/api/v1/people/bulk_match?reveal_personal_emails=true&reveal_phone_number=false"
+STATIC_HEADERS = {
+    "accept": "application/json",
+    "Content-Type": "application/json",
+    "Cache-Control": "no-cache"
+}
+
+# Shared HTTP session so batches reuse the same keep-alive connection to Apollo
+SESSION = requests.Session()
+# One pooled connection per batch that can be in flight across all jobs
+SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=MAX_CONCURRENT_JOBS * MAX_IN_FLIGHT, max_retries=Retry(total=0)))
+SESSION.headers.update(STATIC_HEADERS)
+
+RATE_LIMIT_PAUSE_SECONDS = 3  # Pause when Apollo reports we are close to the limit
+MAX_ATTEMPTS = 5  # Attempts per batch on rate limits, gateway errors and dropped connections
+RETRY_STATUSES = {429, 502, 503, 504}
+BACKOFF_BASE_SECONDS = 1
+BACKOFF_CAP_SECONDS = 30
+
+# Emails for one batch plus the rate limit state Apollo reported with them
+BatchResult = namedtuple("BatchResult", ["emails", "remaining", "limit", "retry_after"])
+# Placeholders fetch_bulk_emails fills a whole batch with when the request fails
+BATCH_ERRORS = {"Validation Error", "API Error", "HTTP Error"}
+
+def parse_int_header(headers, name):
+    try:
+        return int(float(headers.get(name)))
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt):
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(BACKOFF_CAP_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+class RateLimiter:
+    """Caps in-flight Apollo batches and holds back new ones when the rate limit runs low.
+
+    The concurrency cap follows AIMD: it grows by a half slot after every fast
+    response and halves on a slow one or on 429/502/503.
+    """
+
+    def __init__(self, process_id, max_in_flight, min_in_flight=1, initial_in_flight=2, latency_target=5.0):
+        self.process_id = process_id
+        self.max_in_flight = max_in_flight
+        self.min_in_flight = min_in_flight
+        self.latency_target = latency_target
+        self.concurrency = float(min(max_in_flight, initial_in_flight))
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._resume_at = 0.0
+
+    def acquire(self):
+        with self._cond:
+            while self._in_flight >= int(self.concurrency):
+                self._cond.wait()
+            self._in_flight += 1
+        self.wait_for_resume()
+
+    def wait_for_resume(self):
+        """Sleep out any pause set by this or another batch."""
+        with self._cond:
+            wait = self._resume_at - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+
+    def release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def adjust(self, latency, status_code):
+        with self._cond:
+            if status_code in (429, 502, 503) or latency > self.latency_target:
+                self.concurrency = max(self.min_in_flight, self.concurrency * 0.5)
+            else:
+                self.concurrency = min(self.max_in_flight, self.concurrency + 0.5)
+            self._cond.notify_all()
+
+    def pause(self, seconds):
+        with self._cond:
+            self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+
+    def observe(self, result):
+        """Hold back new batches according to the rate limit state of a finished one."""
+        if result.retry_after is not None:
+            add_log(self.process_id, f"Apollo asked us to retry after {result.retry_after}s, pausing new batches")
+            self.pause(result.retry_after)
+            return
+
+        if result.remaining is None:
+            return
+        threshold = max(2, result.limit // 10) if result.limit else 2
+        if result.remaining <= threshold:
+            add_log(self.process_id, f"Only {result.remaining} Apollo requests left, pausing new batches for {RATE_LIMIT_PAUSE_SECONDS}s")
+            self.pause(RATE_LIMIT_PAUSE_SECONDS)
+
+def add_log(process_id, message):
+    global log_seq
     timestamp = datetime.now().strftime("%H:%M:%S")
     log_entry = f"[{timestamp}] {message}"
-    processing_logs.append(log_entry)
+    with log_lock:
+        if process_id not in LOGS:
+            LOGS[process_id] = deque(maxlen=MAX_LOG_ENTRIES)
+        log_seq += 1
+        LOGS[process_id].append((log_seq, log_entry))
+        for subscriber in log_subscribers.get(process_id, ()):
+            subscriber.put({'type': 'log', 'seq': log_seq, 'message': log_entry})
     print(log_entry)  # Also print to console
 
-def load_history():
-    if os.path.exists(app.config['HISTORY_FILE']):
-        try:
-            with open(app.config['HISTORY_FILE'], 'r') as f:
-                return json.load(f)
-        except:
-            return []
-    return []
+def retire_logs(process_id):
+    """Mark a job's logs as finished, dropping the oldest finished jobs' logs past the limit."""
+    with log_lock:
+        finished_log_jobs.append(process_id)
+        while len(finished_log_jobs) > MAX_LOGGED_JOBS:
+            LOGS.pop(finished_log_jobs.popleft(), None)
+
+def notify_status_change(process_id):
+    """Wake the job's /stream connections so they can pick up that it finished or failed."""
+    with log_lock:
+        for subscriber in log_subscribers.get(process_id, ()):
+            subscriber.put({'type': 'status'})
+
+def get_logs(process_id, since=0):
+    """Return the job's log messages newer than `since` and the latest sequence number."""
+    with log_lock:
+        return [entry for seq, entry in LOGS.get(process_id, ()) if seq > since], log_seq
+
+_HIST_CACHE = {"mtime": None, "data": []}  # Parsed history, valid while the file's mtime is unchanged
+history_lock = threading.Lock()
+
+def migrate_legacy_history():
+    """Convert the old JSON array history file to JSONL, once."""
+    if os.path.exists(app.config['HISTORY_FILE']) or not os.path.exists(app.config['LEGACY_HISTORY_FILE']):
+        return
+    try:
+        with open(app.config['LEGACY_HISTORY_FILE'], 'rb') as f:
+            history = orjson.loads(f.read())
+    except:
+        return
+    with open(app.config['HISTORY_FILE'], 'wb') as f:
+        f.writelines(orjson.dumps(entry) + b"\n" for entry in history)
 
-def save_history(history):
-    with open(app.config['HISTORY_FILE'], 'w') as f:
-        json.dump(history, f, indent=2)
+def load_history():
+    try:
+        mtime = os.stat(app.config['HISTORY_FILE']).st_mtime_ns
+    except OSError:
+        return []
+    if _HIST_CACHE["mtime"] == mtime:
+        return _HIST_CACHE["data"]
+    history = []
+    try:
+        with open(app.config['HISTORY_FILE'], 'rb') as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                # Skip a bad line (typically a torn write after a crash) rather than losing everything
+                try:
+                    history.append(orjson.loads(line))
+                except orjson.JSONDecodeError:
+                    print(f"Skipping unreadable history line {line_number}")
+    except OSError:
+        return []
+    _HIST_CACHE.update(mtime=mtime, data=history)
+    return history
 
 def add_history_entry(original_filename, output_filename, status, rows_processed=0):
-    history = load_history()
-    history.append({
+    entry = {
         'type': 'processing',
         'id': str(uuid.uuid4()),
         'original_filename': original_filename,
@@ -65,66 +238,118 @@ def add_history_entry(original_filename, output_filename, status, rows_processed
         'status': status,
         'rows_processed': rows_processed,
         'timestamp': datetime.now().isoformat()
-    })
-    save_history(history)
-
-def extract_domain(url):
-    if pd.isna(url) or not isinstance(url, str) or url.strip() == "":
-        return None
-    parsed = urlparse(url.strip())
-    domain = parsed.netloc or parsed.path
-    domain = domain.strip("/")
-    if domain.startswith("www."):
-        domain = domain[4:]
-    return domain
-
-def build_request_row(row):
-    first_name = row["First Name"] if pd.notna(row["First Name"]) else None
-    last_name = row["Last Name"] if pd.notna(row["Last Name"]) else None
-    linkedin_url = row["LinkedIn URL"] if pd.notna(row["LinkedIn URL"]) else None
-    organization_name = row["Company Name"] if pd.notna(row["Company Name"]) else None
-    domain = extract_domain(row["Company Website"])
-
-    if not first_name or not last_name or (not domain and not linkedin_url):
-        return None
-
-    return {
-        "first_name": first_name.strip() if first_name else None,
-        "last_name": last_name.strip() if last_name else None,
-        "linkedin_url": linkedin_url.strip() if linkedin_url else None,
-        "organization_name": organization_name.strip() if organization_name else None,
-        "domain": domain
-    }
-
-def fetch_bulk_emails(batch, api_key):
-    url = "https://api.apollo.io/api/v1/people/bulk_match?reveal_personal_emails=true&reveal_phone_number=false"
-    payload = {"details": batch}
-    headers = {
-        "x-api-key": api_key,
-        "accept": "application/json",
-        "Content-Type": "application/json",
-        "Cache-Control": "no-cache"
     }
+    with history_lock:
+        history = load_history()  # Brings the cache up to date before appending
+        with open(app.config['HISTORY_FILE'], 'a+b') as f:
+            # Start on a fresh line if the last write was torn
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+            f.write(orjson.dumps(entry) + b"\n")
+        _HIST_CACHE.update(mtime=os.stat(app.config['HISTORY_FILE']).st_mtime_ns, data=history + [entry])
+
+# Carry over history written before the switch to JSONL
+migrate_legacy_history()
+
+# Host part of a company website: optional scheme and "www.", up to the first /, ? or #.
+# A prefix must be followed by a host, and the host runs to that delimiter without starting or
+# ending in ":", so "https://", "www." or "ftp://x.com" can't backtrack into a junk domain.
+DOMAIN_RE = re.compile(
+    r"^\s*(?:https?://(?=[^/?#\s])|(?!https?://))(?:www\.(?=[^/?#\s])|(?!www\.))([^/?#\s:][^/?#\s]*)(?![^/?#\s])(?<!:)",
+    re.IGNORECASE
+)
+
+def clean_text_column(series):
+    """Strip whitespace and treat empty strings as missing."""
+    cleaned = series.astype("string").str.strip()
+    return cleaned.mask(cleaned == "")
+
+def build_request_frame(df):
+    """Build Apollo request fields for every row at once, plus a mask of rows worth sending."""
+    request_df = pd.DataFrame({
+        "first_name": clean_text_column(df["First Name"]),
+        "last_name": clean_text_column(df["Last Name"]),
+        "linkedin_url": clean_text_column(df["LinkedIn URL"]),
+        "organization_name": clean_text_column(df["Company Name"]),
+        "domain": clean_text_column(df["_domain"])
+    }, index=df.index)
+
+    valid = (
+        request_df["first_name"].notna()
+        & request_df["last_name"].notna()
+        & (request_df["domain"].notna() | request_df["linkedin_url"].notna())
+    )
+
+    # Missing values must go out as JSON null, not NaN
+    request_df = request_df.astype(object).where(request_df.notna(), None)
+    return request_df, valid
+
+def fetch_bulk_emails(batch, api_key, process_id, rate_limiter=None):
+    body = orjson.dumps({"details": batch})  # Encoded once, reused across retries
+
+    # One key per call, shared by its retries: lets Apollo dedupe a retry of a request it already
+    # charged for without mistaking the same rows in another job for a replay
+    idempotency_key = str(uuid.uuid4())
+    headers = {"x-api-key": api_key, "Idempotency-Key": idempotency_key}
 
     try:
-        response = requests.post(url, json=payload, headers=headers)
+        for attempt in range(MAX_ATTEMPTS):
+            last_attempt = attempt == MAX_ATTEMPTS - 1
+            if attempt and rate_limiter:
+                # Another batch may have hit a rate limit while this one was backing off
+                rate_limiter.wait_for_resume()
+            try:
+                response = SESSION.post(APOLLO_URL, data=body, headers=headers, timeout=(5, 30))
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if last_attempt:
+                    raise
+                delay = backoff_delay(attempt)
+                add_log(process_id, f"Connection error: {e}. Retrying batch in {delay:.1f}s (attempt {attempt + 1}/{MAX_ATTEMPTS})")
+                time.sleep(delay)
+                continue
+
+            if rate_limiter:
+                rate_limiter.adjust(response.elapsed.total_seconds(), response.status_code)
+
+            # Hourly/daily limits can ask for hours; never hold a slot longer than the backoff cap,
+            # and never sleep a negative time on a bogus header
+            retry_after = parse_int_header(response.headers, "retry-after")
+            if retry_after is not None:
+                retry_after = max(0, min(retry_after, BACKOFF_CAP_SECONDS))
+            if response.status_code not in RETRY_STATUSES or last_attempt:
+                break
+
+            # Honor Retry-After when Apollo sends it, otherwise back off with jitter
+            delay = retry_after if retry_after is not None else backoff_delay(attempt)
+            if rate_limiter and response.status_code == 429:
+                rate_limiter.pause(delay)  # Hold back the job's other batches right away
+            add_log(process_id, f"Apollo returned {response.status_code}, retrying batch in {delay:.1f}s (attempt {attempt + 1}/{MAX_ATTEMPTS})")
+            time.sleep(delay)
+
+        rate_limit = (
+            parse_int_header(response.headers, "x-ratelimit-requests-remaining"),
+            parse_int_header(response.headers, "x-ratelimit-requests-limit"),
+            retry_after
+        )
         
         if response.status_code == 422:
-            add_log(f"Validation error from Apollo. Status: {response.status_code}")
-            add_log(f"Response: {response.text[:200]}...")
-            return ["Validation Error"] * len(batch)
+            add_log(process_id, f"Validation error from Apollo. Status: {response.status_code}")
+            add_log(process_id, f"Response: {response.text[:200]}...")
+            return BatchResult(["Validation Error"] * len(batch), *rate_limit)
 
         # Check for insufficient credits or other API errors
         if response.status_code != 200:
             error_msg = response.text
-            add_log(f"API Error: {response.status_code} - {error_msg}")
+            add_log(process_id, f"API Error: {response.status_code} - {error_msg}")
             if "insufficient credits" in error_msg.lower():
-                add_log("❌ STOPPING: Insufficient Apollo credits. Please upgrade your plan.")
+                add_log(process_id, "❌ STOPPING: Insufficient Apollo credits. Please upgrade your plan.")
                 raise Exception("Insufficient Apollo credits. Please upgrade your plan.")
-            return ["API Error"] * len(batch)
+            return BatchResult(["API Error"] * len(batch), *rate_limit)
 
         response.raise_for_status()
-        data = response.json()
+        data = orjson.loads(response.content)
         emails = []
         if "matches" in data:
             for match in data["matches"]:
@@ -132,19 +357,20 @@ def fetch_bulk_emails(batch, api_key):
                 emails.append(email)
         else:
             emails = ["No email found"] * len(batch)
-        return emails
+        return BatchResult(emails, *rate_limit)
     except requests.exceptions.HTTPError as e:
-        add_log(f"HTTP Error: {e}")
-        add_log(f"Response Body: {response.text if 'response' in locals() else 'No response'}")
-        return ["HTTP Error"] * len(batch)
+        add_log(process_id, f"HTTP Error: {e}")
+        add_log(process_id, f"Response Body: {response.text if 'response' in locals() else 'No response'}")
+        return BatchResult(["HTTP Error"] * len(batch), None, None, None)
     except Exception as e:
-        add_log(f"General Error: {e}")
+        add_log(process_id, f"General Error: {e}")
         # Re-raise the exception to stop processing
         raise e
 
 def process_csv(api_key, input_file_path, output_file_path, original_filename, process_id):
+    rows_processed = 0
     try:
-        add_log("Starting CSV processing...")
+        add_log(process_id, "Starting CSV processing...")
         
         # Initialize processing status for this process
         processing_status[process_id] = {
@@ -155,53 +381,156 @@ def process_csv(api_key, input_file_path, output_file_path, original_filename, p
             'error_message': None
         }
         
-        # Read CSV
-        df = pd.read_csv(input_file_path)
-        add_log(f"Loaded CSV with {len(df)} rows")
-
         REQUIRED_HEADERS = ["First Name", "Last Name", "LinkedIn URL", "Company Name", "Company Website"]
-        
-        # Keep only required columns
-        df = df[REQUIRED_HEADERS].copy()
-        df["Email"] = ""  # new column for emails
+        OUTPUT_HEADERS = REQUIRED_HEADERS + ["Email"]
 
         BATCH_SIZE = 10
-        DELAY_SECONDS = 3
-        total_rows = len(df)
-        rows_processed = 0
-        
-        add_log(f"Processing {total_rows} rows in batches of {BATCH_SIZE}")
-
-        for start in range(0, total_rows, BATCH_SIZE):
-            batch_df = df.iloc[start:start+BATCH_SIZE]
-            add_log(f"Processing batch {start//BATCH_SIZE + 1}: rows {start+1} to {min(start+len(batch_df), total_rows)}")
-
-            requests_batch = []
-            batch_indexes = []
-
-            # Build batch, skip invalid rows
-            for idx, row in batch_df.iterrows():
-                req = build_request_row(row)
-                if req:
-                    requests_batch.append(req)
-                    batch_indexes.append(idx)
-
-            if not requests_batch:
-                add_log(f"Skipping batch - no valid data")
-                time.sleep(DELAY_SECONDS)
-                continue
-
-            add_log(f"Sending batch with {len(requests_batch)} valid records")
-            emails = fetch_bulk_emails(requests_batch, api_key)
-            df.loc[batch_indexes, "Email"] = emails
-            rows_processed += len(requests_batch)
-            
-            add_log(f"Batch completed. Waiting {DELAY_SECONDS} seconds before next batch...")
-            time.sleep(DELAY_SECONDS)
-
-        # Save to new CSV with only input columns + Email
-        df.to_csv(output_file_path, index=False)
-        add_log(f"Processing complete! Output saved to {output_file_path}")
+        CHUNK_SIZE = 10_000  # Rows read from the CSV at a time, a multiple of BATCH_SIZE
+        DEDUPE_FIELDS = ["first_name", "last_name", "domain", "linkedin_url"]  # Rows matching on these share one lookup
+        total_rows = 0
+        batch_number = 0
+        emails_by_key = {}  # Email found for each dedupe key, across the whole file
+
+        # Check the header first so a missing column gives a readable error
+        columns = pd.read_csv(input_file_path, nrows=0).columns
+        missing_headers = [header for header in REQUIRED_HEADERS if header not in columns]
+        if missing_headers:
+            raise Exception(f"CSV is missing required columns: {', '.join(missing_headers)}")
+
+        # Stream the CSV in chunks, parsing only the required columns as plain strings
+        reader = pd.read_csv(
+            input_file_path,
+            usecols=REQUIRED_HEADERS,
+            dtype=str,
+            na_filter=True,
+            keep_default_na=True,
+            engine="c",
+            chunksize=CHUNK_SIZE
+        )
+        add_log(process_id, f"Processing rows in chunks of {CHUNK_SIZE} and batches of {BATCH_SIZE}")
+
+        rate_limiter = RateLimiter(process_id, MAX_IN_FLIGHT)
+
+        def on_batch_done(future):
+            # Set any pause before freeing the slot, so a waiting batch can't slip out ahead of it
+            try:
+                if not future.exception():
+                    rate_limiter.observe(future.result())
+            finally:
+                rate_limiter.release()
+
+        def write_ready_rows():
+            # Write rows in input order, stopping at the first one without an email yet
+            nonlocal written, rows_processed
+            end = written
+            while end < len(df):
+                if not ready[end]:
+                    # Duplicates take the email their first occurrence found
+                    if not (reuse[end] and keys[end] in emails_by_key):
+                        break
+                    emails_out[end] = emails_by_key[keys[end]]
+                    ready[end] = True
+                    rows_processed += 1
+                end += 1
+            if end > written:
+                rows = df.iloc[written:end][REQUIRED_HEADERS].fillna("")
+                writer.writerows(zip(*(rows[header] for header in REQUIRED_HEADERS), emails_out[written:end]))
+                output_file.flush()
+                written = end
+
+        def collect_results(timeout=None):
+            # With timeout=0 only picks up batches that are already done
+            nonlocal rows_processed
+            done, _ = wait(futures, timeout=timeout)
+            for future in done:
+                finished_batch, batch_positions = futures.pop(future)
+                emails = future.result().emails
+                emails_out[batch_positions] = emails
+                ready[batch_positions] = True
+                # Batch-wide errors say nothing about the person, so duplicates must not reuse them,
+                # unless the batch held just that one record
+                emails_by_key.update(
+                    (key, email) for key, email in zip(keys[batch_positions], emails)
+                    if email not in BATCH_ERRORS or len(batch_positions) == 1
+                )
+                rows_processed += len(batch_positions)
+                add_log(process_id, f"Batch {finished_batch} completed")
+            write_ready_rows()
+
+        def send_batch(batch_positions):
+            nonlocal batch_number
+            batch_number += 1
+            requests_batch = request_df.iloc[batch_positions].to_dict(orient="records")
+
+            # Wait for a free slot (and any rate limit pause), then write whatever finished meanwhile
+            rate_limiter.acquire()
+            try:
+                collect_results(timeout=0)
+            except Exception:
+                rate_limiter.release()
+                raise
+
+            add_log(process_id, f"Sending batch {batch_number} with {len(requests_batch)} valid records")
+            future = executor.submit(fetch_bulk_emails, requests_batch, api_key, process_id, rate_limiter)
+            future.add_done_callback(on_batch_done)
+            futures[future] = (batch_number, batch_positions)
+
+        with open(output_file_path, "w", newline="") as output_file, ThreadPoolExecutor(max_workers=MAX_IN_FLIGHT) as executor:
+            writer = csv.writer(output_file)
+            writer.writerow(OUTPUT_HEADERS)
+
+            for df in reader:
+                first_row = total_rows
+                total_rows += len(df)
+                add_log(process_id, f"Loaded rows {first_row+1} to {total_rows}")
+
+                # Domain for every row in a single regex pass
+                df["_domain"] = df["Company Website"].str.extract(DOMAIN_RE, expand=False).str.lower()
+                # Emails by row position, filled in as batches finish
+                emails_out = np.empty(len(df), dtype=object)
+                emails_out[:] = ""
+
+                # Normalize and validate the whole chunk up front instead of row by row
+                request_df, valid = build_request_frame(df)
+                valid = valid.to_numpy()
+
+                # Only the first occurrence of each person goes to Apollo
+                keys = pd.util.hash_pandas_object(request_df[DEDUPE_FIELDS], index=False).to_numpy()
+                seen = pd.Series(keys).duplicated().to_numpy() | np.isin(keys, list(emails_by_key))
+                reuse = valid & seen
+                if reuse.any():
+                    add_log(process_id, f"Found {int(reuse.sum())} duplicate rows, reusing their lookups")
+
+                ready = ~valid  # Rows whose output is final; invalid rows go out without an email
+                written = 0  # Rows of this chunk already in the output file
+                futures = {}  # In-flight batches: future -> (batch number, row positions)
+                for start in range(0, len(df), BATCH_SIZE):
+                    add_log(process_id, f"Processing rows {first_row+start+1} to {first_row+min(start+BATCH_SIZE, len(df))}")
+
+                    # Build batch, skip invalid and duplicate rows
+                    batch_positions = start + np.flatnonzero(valid[start:start+BATCH_SIZE] & ~seen[start:start+BATCH_SIZE])
+                    if not len(batch_positions):
+                        if reuse[start:start+BATCH_SIZE].any():
+                            add_log(process_id, "Skipping batch - only duplicates of rows already sent")
+                        else:
+                            add_log(process_id, "Skipping batch - no valid data")
+                        continue
+                    send_batch(batch_positions)
+                collect_results()
+
+                # Duplicates whose first lookup failed as a whole batch get one lookup per person. They go
+                # one per request so the record that broke the first batch can't break them again, and
+                # whatever that lookup returns is then reused for the remaining copies.
+                retry = np.flatnonzero(~ready & reuse & ~np.isin(keys, list(emails_by_key)))
+                retry = retry[~pd.Series(keys[retry]).duplicated().to_numpy()]
+                if len(retry):
+                    add_log(process_id, f"Looking up {len(retry)} duplicate rows whose first lookup failed")
+                    reuse[retry] = False
+                    for i in range(len(retry)):
+                        send_batch(retry[i:i+1])
+                    collect_results()
+
+        add_log(process_id, f"Processing complete! Output saved to {output_file_path}")
         
         # Add to history
         add_history_entry(original_filename, os.path.basename(output_file_path), "completed", rows_processed)
@@ -217,8 +546,13 @@ def process_csv(api_key, input_file_path, output_file_path, original_filename, p
         
     except Exception as e:
         error_message = str(e)
-        add_log(f"❌ FATAL ERROR: {error_message}")
-        add_history_entry(original_filename, "", "failed", 0)
+        add_log(process_id, f"❌ FATAL ERROR: {error_message}")
+
+        # Rows written before the failure are still in the output file
+        partial_output = os.path.basename(output_file_path) if rows_processed else ""
+        if partial_output:
+            add_log(process_id, f"Partial results saved to {output_file_path}")
+        add_history_entry(original_filename, partial_output, "failed", rows_processed)
         
         # Update status with error
         processing_status[process_id] = {
@@ -229,19 +563,19 @@ def process_csv(api_key, input_file_path, output_file_path, original_filename, p
             'error_message': error_message
         }
     finally:
-        pass
+        retire_logs(process_id)
+        notify_status_change(process_id)
 
 @app.route('/')
 def index():
      global saved_api_key
     # Check if there's a saved API key to determine checkbox state
      has_saved_key = bool(saved_api_key)
-     return render_template('index.html', logs=processing_logs, saved_api_key=saved_api_key, has_saved_key=has_saved_key)
+     return render_template('index.html', logs=get_logs(session.get('process_id'))[0], saved_api_key=saved_api_key, has_saved_key=has_saved_key)
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
-    global processing_logs, saved_api_key
-    processing_logs = []  # Clear previous logs
+    global saved_api_key
     
     try:
         api_key = request.form['api_key']
@@ -254,7 +588,6 @@ def upload_file():
         # Save API key if requested
         if save_api_key_flag:
             saved_api_key = api_key
-            add_log("API key saved for future use")
         else:
             saved_api_key = ""  # Clear saved key if not saving
             
@@ -281,13 +614,21 @@ def upload_file():
             # Generate unique process ID
             process_id = str(uuid.uuid4())
             session['process_id'] = process_id
+            if save_api_key_flag:
+                add_log(process_id, "API key saved for future use")
+
+            # Register the job now so /stream knows it before the pool picks it up
+            processing_status[process_id] = {
+                'download_ready': False,
+                'download_file': None,
+                'download_filename': None,
+                'error': False,
+                'error_message': None
+            }
             
-            # Start processing in background thread
-            thread = threading.Thread(
-                target=process_csv, 
-                args=(api_key, input_path, output_path, filename, process_id)
-            )
-            thread.start()
+            # Start processing in the background job pool; it waits there if all slots are busy
+            add_log(process_id, "Queued, waiting for a free slot")
+            JOB_EXECUTOR.submit(process_csv, api_key, input_path, output_path, filename, process_id)
             
             flash('File uploaded successfully. Processing started...')
             return redirect(url_for('processing'))
@@ -301,42 +642,116 @@ def upload_file():
 
 @app.route('/processing')
 def processing():
-    return render_template('processing.html', logs=processing_logs)
+    logs, last_seq = get_logs(session.get('process_id'))
+    return render_template('processing.html', logs=logs, last_seq=last_seq)
 
 @app.route('/logs')
 def logs():
-    return jsonify({'logs': processing_logs})
+    # Only send entries the client hasn't seen yet
+    process_id = request.args.get('pid') or session.get('process_id')
+    logs, last_seq = get_logs(process_id, request.args.get('since', 0, type=int))
+    return json_response({'logs': logs, 'last_seq': last_seq})
 
-@app.route('/check_download')
-def check_download():
-    process_id = session.get('process_id')
+def download_status(process_id):
     if process_id and process_id in processing_status:
         status = processing_status[process_id]
         if status.get('error'):
-            return jsonify({
+            return {
                 'ready': False,
                 'error': True,
                 'error_message': status.get('error_message')
-            })
+            }
         if status.get('download_ready'):
-            return jsonify({
+            return {
                 'ready': True,
                 'file': status.get('download_file'),
                 'filename': status.get('download_filename')
-            })
-    return jsonify({'ready': False})
+            }
+    return {'ready': False}
+
+@app.route('/check_download')
+def check_download():
+    return json_response(download_status(session.get('process_id')))
+
+@app.route('/stream')
+def stream():
+    """Push new log entries and the final job status as Server-Sent Events."""
+    global open_streams
+    process_id = request.args.get('pid') or session.get('process_id')
+    # EventSource sends Last-Event-ID when it reconnects
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('since', 0, type=int)
+
+    def event_data(payload):
+        return f"data: {orjson.dumps(payload).decode()}\n\n"
+
+    def log_event(seq, message):
+        return f"id: {seq}\n{event_data({'type': 'log', 'message': message})}"
+
+    def close_with(payload):
+        yield event_data(payload)
+
+    subscriber = queue.Queue()
+    with log_lock:
+        # Unknown job (no session, or a tab left open across a restart): nothing will ever finish
+        if process_id not in processing_status:
+            return Response(close_with({'type': 'unknown'}), mimetype='text/event-stream')
+        # Each stream pins a server thread, so past the cap the page falls back to polling
+        if open_streams >= MAX_OPEN_STREAMS:
+            return Response(close_with({'type': 'busy'}), mimetype='text/event-stream')
+        open_streams += 1
+        backlog = [(seq, entry) for seq, entry in LOGS.get(process_id, ()) if seq > since]
+        log_subscribers.setdefault(process_id, set()).add(subscriber)
+
+    def release_stream():
+        # Runs when the response closes, even if the generator never started
+        global open_streams
+        with log_lock:
+            open_streams -= 1
+            subscribers = log_subscribers.get(process_id, set())
+            subscribers.discard(subscriber)
+            if not subscribers:
+                log_subscribers.pop(process_id, None)
+
+    def generate():
+        deadline = time.monotonic() + STREAM_MAX_SECONDS
+        for seq, entry in backlog:
+            yield log_event(seq, entry)
+        while time.monotonic() < deadline:
+            status = download_status(process_id)
+            if status.get('ready') or status.get('error'):
+                # Flush logs queued before the job finished, then close the stream
+                while not subscriber.empty():
+                    event = subscriber.get_nowait()
+                    if event['type'] == 'log':
+                        yield log_event(event['seq'], event['message'])
+                yield event_data({'type': 'status', **status})
+                return
+            try:
+                event = subscriber.get(timeout=min(STREAM_KEEPALIVE_SECONDS, max(0, deadline - time.monotonic())))
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+            if event['type'] == 'log':
+                yield log_event(event['seq'], event['message'])
+
+    response = Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(release_stream)
+    return response
 
 @app.route('/api_key')
 def show_api_key():
     global saved_api_key
     # Return the current API key being used (from form input, not saved)
     # This will be handled via JavaScript on the frontend
-    return jsonify({'api_key': saved_api_key})
+    return json_response({'api_key': saved_api_key})
 
 @app.route('/download/<filename>')
 def download_file(filename):
     try:
-        return send_file(os.path.join(app.config['OUTPUT_FOLDER'], filename), as_attachment=True)
+        # max_age=0 makes the browser revalidate, since an output is still growing while its job runs
+        return send_file(os.path.join(app.config['OUTPUT_FOLDER'], filename), as_attachment=True, max_age=0)
     except:
         flash('File not found')
         return redirect(url_for('index'))
@@ -6,4 +6,5 @@ pip install --upgrade pip
 pip install -r requirements.txt
 
 # Start your app (example for Flask)
-gunicorn app:app --bind 0.0.0.0:$PORT
\ No newline at end of file
+# One worker keeps job state in memory; threads let polls run alongside each other
+gunicorn app:app --bind 0.0.0.0:$PORT --workers 1 --threads 8
\ No newline at end of file